@@ -1,38 +1,127 @@
-""""Genera el hash de una contraseña utilizando SHA-256.
+""""Genera el hash de una contraseña utilizando PBKDF2-HMAC-SHA256 con sal por usuario.
 
 @param password Contraseña en texto plano a convertir en hash.
+@param salt Sal del usuario codificada en hexadecimal.
+@param iterations Número de iteraciones de PBKDF2.
 
-@returns Cadena con el hash resultante de la contraseña.
+@returns Cadena hexadecimal con el hash resultante de la contraseña.
 """
-import json
+import hmac
 import hashlib
+import secrets
 from pathlib import Path
 from typing import Dict, Any, Optional, Union
+import orjson
 import streamlit as st
 
 USERS_PATH: Path = Path('users.json')
+USERS_CACHE_KEY: str = '_users_cache'
+PBKDF2_ITERATIONS: int = 100_000
 
 
-def _hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode('utf-8')).hexdigest()
+def _hash_password(password: str, salt: str, iterations: int = PBKDF2_ITERATIONS) -> str:
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), bytes.fromhex(salt), iterations).hex()
 
 
-""""Carga los usuarios desde el archivo JSON, o crea uno por defecto si no existe.
+""""Crea el registro de un usuario con una sal nueva y el hash de su contraseña.
 
-@returns Diccionario con los usuarios y sus datos (hash de contraseña y permisos).
+@param password Contraseña en texto plano.
+@param is_admin Indica si el usuario es administrador.
+
+@returns Diccionario con sal, iteraciones, hash de contraseña y permisos.
 """
-def load_users() -> Dict[str, Any]:
+def _make_user_record(password: str, is_admin: bool) -> Dict[str, Any]:
+    salt = secrets.token_hex(16)
+    return {
+        'salt': salt,
+        'iterations': PBKDF2_ITERATIONS,
+        'password_hash': _hash_password(password, salt, PBKDF2_ITERATIONS),
+        'is_admin': bool(is_admin),
+    }
+
+
+""""Comprueba una contraseña contra un registro de usuario.
+
+Los registros antiguos sin sal (SHA-256 simple) se siguen aceptando.
+
+@param record Registro del usuario tal como se guarda en el JSON.
+@param password Contraseña en texto plano a verificar.
+
+@returns True si la contraseña coincide, False en caso contrario.
+"""
+def _check_password(record: Dict[str, Any], password: str) -> bool:
+    stored = str(record.get('password_hash', ''))
+    salt = record.get('salt')
+    if salt is None:
+        legacy = hashlib.sha256(password.encode('utf-8')).hexdigest()
+        return hmac.compare_digest(stored, legacy)
+    iterations = int(record.get('iterations', PBKDF2_ITERATIONS))
+    return hmac.compare_digest(stored, _hash_password(password, salt, iterations))
+
+
+# Registro ficticio con sal propia: se comprueba cuando el usuario no existe para
+# que la respuesta tarde lo mismo y no revele qué nombres de usuario son válidos
+_DUMMY_RECORD: Dict[str, Any] = _make_user_record(secrets.token_hex(16), False)
+
+
+""""Comprueba una contraseña en tiempo constante, exista o no el usuario.
+
+@param record Registro del usuario, o None si no existe (o no cumple el rol pedido).
+@param password Contraseña en texto plano a verificar.
+
+@returns True solo si el registro existe y la contraseña coincide.
+"""
+def _verify_record(record: Optional[Dict[str, Any]], password: str) -> bool:
+    matches = _check_password(record if record is not None else _DUMMY_RECORD, password)
+    return matches and record is not None
+
+
+""""Lee y decodifica el archivo de usuarios desde disco (compartido entre sesiones).
+
+@returns Diccionario con los usuarios, o None si el archivo no existe.
+"""
+@st.cache_data(ttl=60, show_spinner=False)
+def _load_users_from_disk() -> Optional[Dict[str, Any]]:
     if not USERS_PATH.exists():
-        default = {'admin': {'password_hash': _hash_password('admin123'), 'is_admin': True}}
-        save_users(default)
-        return default
+        return None
     try:
-        with USERS_PATH.open('r', encoding='utf-8') as f:
-            return json.load(f)
+        return orjson.loads(USERS_PATH.read_bytes())
     except Exception:
         return {}
 
 
+""""Carga los usuarios desde el archivo JSON, o crea uno por defecto si no existe.
+
+El resultado se guarda en la sesión para no releer el archivo en cada rerun;
+solo debe usarse para consultas, no para modificar y guardar.
+
+@returns Diccionario con los usuarios y sus datos (hash de contraseña y permisos).
+"""
+def load_users() -> Dict[str, Any]:
+    cached = st.session_state.get(USERS_CACHE_KEY)
+    if cached is not None:
+        return cached
+    users = _load_users_from_disk()
+    if users is None:
+        users = {'admin': _make_user_record('admin123', True)}
+        save_users(users)
+        return users
+    st.session_state[USERS_CACHE_KEY] = users
+    return users
+
+
+""""Relee los usuarios directamente del archivo, ignorando las cachés.
+
+Se usa antes de modificar y guardar, para no sobrescribir cambios hechos por otras sesiones.
+
+@returns Diccionario con los usuarios tal como están en disco.
+"""
+def _load_users_fresh() -> Dict[str, Any]:
+    _load_users_from_disk.clear()
+    st.session_state.pop(USERS_CACHE_KEY, None)
+    return load_users()
+
+
 """"Guarda los usuarios en el archivo JSON.
 
 @param users Diccionario que contiene los datos de los usuarios a guardar.
@@ -40,8 +129,9 @@ def load_users() -> Dict[str, Any]:
 @returns None. Escribe directamente en el archivo.
 """
 def save_users(users: Dict[str, Any]) -> None:
-    with USERS_PATH.open('w', encoding='utf-8') as f:
-        json.dump(users, f, indent=2)
+    USERS_PATH.write_bytes(orjson.dumps(users, option=orjson.OPT_INDENT_2))
+    _load_users_from_disk.clear()
+    st.session_state[USERS_CACHE_KEY] = users
 
 
 """"Crea un nuevo usuario con nombre, contraseña y rol (admin o no).
@@ -53,26 +143,47 @@ def save_users(users: Dict[str, Any]) -> None:
 @returns True si el usuario fue creado exitosamente, False si ya existe.
 """
 def create_user(username: str, password: str, is_admin: bool = False) -> bool:
-    users = load_users()
+    users = _load_users_fresh()
     if username in users:
         return False
-    users[username] = {'password_hash': _hash_password(password), 'is_admin': bool(is_admin)}
+    users[username] = _make_user_record(password, is_admin)
     save_users(users)
     return True
 
 
+""""Actualiza a PBKDF2 el hash antiguo sin sal de un usuario tras un acceso correcto.
+
+Relee el archivo antes de guardar y no hace nada si otra sesión ya lo actualizó.
+
+@param username Nombre de usuario.
+@param password Contraseña en texto plano ya verificada.
+
+@returns None. Escribe directamente en el archivo.
+"""
+def _upgrade_legacy_user(username: str, password: str) -> None:
+    users = _load_users_fresh()
+    current = users.get(username)
+    if current is not None and 'salt' not in current:
+        users[username] = _make_user_record(password, current.get('is_admin', False))
+        save_users(users)
+
+
 """"Verifica las credenciales de un usuario.
 
+Si el usuario aún tiene un hash antiguo sin sal, se actualiza a PBKDF2 tras un acceso correcto.
+
 @param username Nombre de usuario.
 @param password Contraseña en texto plano a verificar.
 
 @returns True si las credenciales son correctas, False en caso contrario.
 """
 def verify_user(username: str, password: str) -> bool:
-    users = load_users()
-    if username not in users:
+    record = load_users().get(username)
+    if not _verify_record(record, password):
         return False
-    return users[username].get('password_hash') == _hash_password(password)
+    if 'salt' not in record:
+        _upgrade_legacy_user(username, password)
+    return True
 
 
 """"Verifica si un usuario tiene privilegios de administrador.
@@ -86,6 +197,25 @@ def is_admin(username: str) -> bool:
     return bool(users.get(username, {}).get('is_admin', False))
 
 
+""""Verifica en un solo paso las credenciales y el rol de administrador de un usuario.
+
+@param username Nombre de usuario.
+@param password Contraseña en texto plano a verificar.
+
+@returns True si las credenciales son correctas y el usuario es administrador, False en caso contrario.
+"""
+def authenticate_admin(username: str, password: str) -> bool:
+    record = load_users().get(username)
+    # Los no administradores se tratan como inexistentes, pero igual se ejecuta el hash
+    if record is not None and not record.get('is_admin', False):
+        record = None
+    if not _verify_record(record, password):
+        return False
+    if 'salt' not in record:
+        _upgrade_legacy_user(username, password)
+    return True
+
+
 """"Muestra la interfaz de inicio de sesión para administradores en la barra lateral.
 
 @returns True si hay una sesión activa de administrador, False en caso contrario.
@@ -101,7 +231,7 @@ def admin_login_ui() -> bool:
         username = st.text_input("Usuario", key="admin")
         password = st.text_input("Contraseña", type="password", key="admin123")
         if st.button("Iniciar Sesión", key="admin_login_btn"):
-            if verify_user(username, password) and is_admin(username):
+            if authenticate_admin(username, password):
                 st.session_state['is_admin'] = True
                 st.session_state['_admin_user'] = username
                 st.success(f'Ingresado como administrador: {username}')
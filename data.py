@@ -1,14 +1,34 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
+import numpy as np
 import pandas as pd
 import time
-import random
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import List, Dict, Any, Optional, Tuple
 import streamlit as st
 
 SCODA_URL: str = "https://data.cityofchicago.org/resource/ijzp-q8t2.json"
 DEFAULT_FROM_DATE: str = "2024-01-01T00:00:00"
 
+_RNG: np.random.Generator = np.random.default_rng()
+
+# Límites de espera de la API: (conexión, lectura) por intento, y segundos sin
+# reintentar tras un fallo para que los reruns no vuelvan a bloquearse
+FETCH_TIMEOUT: Tuple[int, int] = (5, 30)
+FETCH_COOLDOWN: int = 60
+
+# Sesión HTTP reutilizable: mantiene viva la conexión TLS con la API entre refrescos
+_SESSION: requests.Session = requests.Session()
+_SESSION.headers.update({'Accept-Encoding': 'gzip, deflate'})
+_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=10,
+    # Sin reintentos por timeout de lectura: una consulta lenta no se repite
+    max_retries=Retry(total=2, read=0, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504)),
+))
+
 SCHEMA_COLUMNS: List[str] = [
     'id', 'case_number', 'date', 'block', 'iucr', 'primary_type',
     'description', 'location_description', 'arrest', 'domestic', 'beat',
@@ -26,114 +46,163 @@ CRIME_TYPES_AREQUIPA: Dict[str, List[str]] = {
     'ESTAFA': ['Fraude', 'Estafa telefónica', 'Clonación de tarjetas'],
 }
 
+# Descripciones por tipo ya convertidas a arreglos, listas para `choice`
+_DESC_LOOKUP: Dict[str, np.ndarray] = {k: np.asarray(v, dtype=object) for k, v in CRIME_TYPES_AREQUIPA.items()}
+_FALLBACK_DESC: np.ndarray = np.asarray(('Incidente',), dtype=object)
+
 LOCATIONS_AREQUIPA: List[str] = [
     'CALLE', 'AVENIDA', 'PARQUE', 'PLAZA', 'TIENDA', 'RESTAURANTE',
     'RESIDENCIA', 'BANCO', 'MERCADO', 'TRANSPORTE PÚBLICO', 'ESTACIONAMIENTO'
 ]
 
+# Columnas de texto con pocos valores distintos: se guardan como 'category'
+CATEGORY_COLUMNS: Tuple[str, ...] = (
+    'primary_type', 'description', 'location_description', 'district', 'ward', 'community_area', 'fbi_code'
+)
+
+# Registros sintéticos de Arequipa en la sesión, como lista de bloques
+AREQUIPA_CHUNKS_KEY: str = '_arequipa_chunks'
+AREQUIPA_DF_KEY: str = '_arequipa_df'
+
+
+def _normalize_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+    # reindex crea de una vez las columnas faltantes y fija el orden del esquema
+    df = df.reindex(columns=SCHEMA_COLUMNS)
+    for col in ['date', 'updated_on']:
+        df[col] = pd.to_datetime(df[col], errors='coerce', cache=True)
+    for coord in ['latitude', 'longitude']:
+        df[coord] = pd.to_numeric(df[coord], errors='coerce')
+    for flag in ['arrest', 'domestic']:
+        df[flag] = df[flag].fillna(False).astype(bool)
+    # Convertir columna 'year' a número para evitar error Arrow
+    df['year'] = pd.to_numeric(df['year'], errors='coerce').astype('Int64')
+    mask = df['location'].notna()
+    if mask.any():
+        df.loc[mask, 'location'] = df.loc[mask, 'location'].astype(str)
+    for col in CATEGORY_COLUMNS:
+        df[col] = df[col].astype('category')
+    return df
+
 
 def _records_to_dataframe(records: List[Dict[str, Any]]) -> pd.DataFrame:
     if not records:
         return pd.DataFrame(columns=SCHEMA_COLUMNS)
-    df = pd.DataFrame(records)
-    for c in SCHEMA_COLUMNS:
-        if c not in df.columns:
-            df[c] = None
-    for col in ['date', 'updated_on']:
-        if col in df.columns:
-            df[col] = pd.to_datetime(df[col], errors='coerce')
-    for coord in ['latitude', 'longitude']:
-        if coord in df.columns:
-            df[coord] = pd.to_numeric(df[coord], errors='coerce')
-    if 'location' in df.columns:
-        df['location'] = df['location'].apply(lambda x: str(x) if not pd.isna(x) else None)
-    return df[SCHEMA_COLUMNS]
+    return _normalize_dataframe(pd.DataFrame.from_records(records))
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def _fetch_chicago(limit: int, bucket: int) -> pd.DataFrame:
+    """Descarga los últimos registros de Chicago; la caché se comparte entre sesiones por intervalo (`bucket`)."""
+    params = {'$limit': limit, '$order': 'date DESC'}
+    resp = _SESSION.get(SCODA_URL, params=params, timeout=FETCH_TIMEOUT)
+    resp.raise_for_status()
+    return _records_to_dataframe(orjson.loads(resp.content))
 
 
 def fetch_latest(limit: int = 5000, force: bool = False, refresh_interval: int = 60) -> pd.DataFrame:
-    key_time = '_chicago_last_fetch_time'
     key_df = '_chicago_last_df'
     key_chicago = '_chicago_base_df'
-    now = time.time()
-    last = st.session_state.get(key_time, 0)
-    
-    # Verificar si necesitamos refrescar desde la API
-    need_refresh = force or (now - last >= refresh_interval) or (key_chicago not in st.session_state)
-    
-    if need_refresh:
-        params = {'$limit': limit, '$order': 'date DESC'}
+    key_fetch = '_chicago_fetch_key'
+    key_combined = '_chicago_combined'
+    key_failed = '_chicago_fetch_failed_at'
+
+    fetch_key = (int(limit), int(time.time() // max(refresh_interval, 1)))
+    if force:
+        _fetch_chicago.clear()
+    if not force and st.session_state.get(key_fetch) == fetch_key and key_chicago in st.session_state:
+        # Mismo intervalo: reutilizar el DataFrame de la sesión en lugar de
+        # deserializar otra copia desde st.cache_data en cada rerun
+        chicago_df = st.session_state[key_chicago]
+    elif not force and time.time() - st.session_state.get(key_failed, 0) < FETCH_COOLDOWN:
+        # La API falló hace poco: no volver a esperar los timeouts en cada rerun
+        st.warning('La API no respondió hace poco; se reintentará en breve')
+        chicago_df = st.session_state.get(key_chicago, pd.DataFrame(columns=SCHEMA_COLUMNS))
+    else:
         try:
-            resp = requests.get(SCODA_URL, params=params, timeout=30)
-            resp.raise_for_status()
-            records = resp.json()
-            chicago_df = _records_to_dataframe(records)
+            chicago_df = _fetch_chicago(*fetch_key)
             st.session_state[key_chicago] = chicago_df
-            st.session_state[key_time] = now
+            st.session_state[key_fetch] = fetch_key
+            st.session_state.pop(key_failed, None)
         except Exception as e:
+            st.session_state[key_failed] = time.time()
             st.error(f'Error fetching data from API: {e}')
             # Si falla, usar datos anteriores si existen
             chicago_df = st.session_state.get(key_chicago, pd.DataFrame(columns=SCHEMA_COLUMNS))
-    else:
-        chicago_df = st.session_state.get(key_chicago, pd.DataFrame(columns=SCHEMA_COLUMNS))
-    
-    # Combinar con datos sintéticos de Arequipa si existen
-    arequipa_df = st.session_state.get('_arequipa_records', pd.DataFrame(columns=SCHEMA_COLUMNS))
     
-    if not arequipa_df.empty:
-        combined_df = pd.concat([arequipa_df, chicago_df], ignore_index=True)
+    # Reutilizar la mezcla de reruns anteriores mientras no cambien los datos de
+    # Chicago ni los bloques de Arequipa (los reruns por widgets no recalculan nada)
+    chunks = st.session_state.get(AREQUIPA_CHUNKS_KEY)
+    n_chunks = len(chunks) if chunks else 0
+    cached = st.session_state.get(key_combined)
+    if cached is not None and cached[0] is chicago_df and cached[1] is chunks and cached[2] == n_chunks:
+        combined_df = cached[3]
     else:
-        combined_df = chicago_df
-
-    # Convertir columna 'year' a número para evitar error Arrow
-    if 'year' in combined_df.columns:
-        combined_df['year'] = pd.to_numeric(combined_df['year'], errors='coerce').astype('Int64')
-
-    # Ordenar por fecha descendente
-    if 'date' in combined_df.columns:
-        combined_df = combined_df.sort_values('date', ascending=False)
-
+        # Combinar con datos sintéticos de Arequipa si existen
+        arequipa_df = get_arequipa_records()
+
+        # Los datos de Chicago ya llegan ordenados por fecha descendente ($order=date DESC);
+        # solo hace falta ordenar al mezclarlos con los de Arequipa
+        if not arequipa_df.empty:
+            arequipa_df = arequipa_df.sort_values('date', ascending=False)
+            combined_df = pd.concat([arequipa_df, chicago_df], ignore_index=True)
+            combined_df = combined_df.sort_values('date', ascending=False, kind='mergesort')
+            # Convertir columna 'year' a número para evitar error Arrow
+            combined_df['year'] = pd.to_numeric(combined_df['year'], errors='coerce').astype('Int64')
+            # concat pierde el dtype 'category' cuando las categorías difieren
+            for col in CATEGORY_COLUMNS:
+                combined_df[col] = combined_df[col].astype('category')
+        else:
+            combined_df = chicago_df
+        st.session_state[key_combined] = (chicago_df, chunks, n_chunks, combined_df)
 
-    
     st.session_state[key_df] = combined_df
     return combined_df
 
 
-def _point_in_polygon(point: Tuple[float, float], polygon: List[Tuple[float, float]]) -> bool:
-    """Verifica si un punto está dentro de un polígono usando ray casting."""
-    lat, lon = point
+def _points_in_polygon(lats: np.ndarray, lons: np.ndarray, polygon: np.ndarray) -> np.ndarray:
+    """Verifica qué puntos están dentro de un polígono usando ray casting vectorizado."""
+    inside = np.zeros(lats.shape, dtype=bool)
     n = len(polygon)
-    inside = False
-    
-    p1_lat, p1_lon = polygon[0]
-    for i in range(1, n + 1):
-        p2_lat, p2_lon = polygon[i % n]
-        if lon > min(p1_lon, p2_lon):
-            if lon <= max(p1_lon, p2_lon):
-                if lat <= max(p1_lat, p2_lat):
-                    if p1_lon != p2_lon:
-                        xinters = (lon - p1_lon) * (p2_lat - p1_lat) / (p2_lon - p1_lon) + p1_lat
-                    if p1_lat == p2_lat or lat <= xinters:
-                        inside = not inside
-        p1_lat, p1_lon = p2_lat, p2_lon
-    
+
+    # Se recorre cada arista una sola vez y se evalúan todos los puntos a la vez
+    for i in range(n):
+        p1_lat, p1_lon = polygon[i]
+        p2_lat, p2_lon = polygon[(i + 1) % n]
+        if p1_lon == p2_lon:
+            continue
+        crosses = (lons > min(p1_lon, p2_lon)) & (lons <= max(p1_lon, p2_lon)) & (lats <= max(p1_lat, p2_lat))
+        if p1_lat != p2_lat:
+            xinters = (lons - p1_lon) * (p2_lat - p1_lat) / (p2_lon - p1_lon) + p1_lat
+            crosses &= lats <= xinters
+        inside ^= crosses
+
     return inside
 
 
-def _generate_point_in_bounds(bounds: List[Tuple[float, float]]) -> Tuple[float, float]:
-    lats = [b[0] for b in bounds]
-    lons = [b[1] for b in bounds]
-    
-    min_lat, max_lat = min(lats), max(lats)
-    min_lon, max_lon = min(lons), max(lons)
-    
+def _generate_points_in_bounds(n: int, bounds: List[Tuple[float, float]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Genera n puntos aleatorios dentro del polígono por muestreo con rechazo en lotes."""
+    polygon = np.asarray(bounds, dtype=float)
+    low = polygon.min(axis=0)
+    high = polygon.max(axis=0)
+
+    lats = np.empty(n)
+    lons = np.empty(n)
+    filled = 0
     for _ in range(100):
-        lat = random.uniform(min_lat, max_lat)
-        lon = random.uniform(min_lon, max_lon)
-        
-        if _point_in_polygon((lat, lon), bounds):
-            return (lat, lon)
-    
-    return (sum(lats) / len(lats), sum(lons) / len(lons))
+        missing = n - filled
+        if missing <= 0:
+            break
+        candidates = _RNG.uniform(low, high, size=(4 * missing, 2))
+        accepted = candidates[_points_in_polygon(candidates[:, 0], candidates[:, 1], polygon)][:missing]
+        lats[filled:filled + len(accepted)] = accepted[:, 0]
+        lons[filled:filled + len(accepted)] = accepted[:, 1]
+        filled += len(accepted)
+
+    # Si el polígono es degenerado, usar el centroide de los vértices
+    center = polygon.mean(axis=0)
+    lats[filled:] = center[0]
+    lons[filled:] = center[1]
+    return lats, lons
 
 
 def generate_random_records_in_zone(
@@ -144,53 +213,52 @@ def generate_random_records_in_zone(
     store_in_session: bool = True
 ) -> pd.DataFrame:
 
-    rows = []
-    now = datetime.utcnow()
+    now = pd.Timestamp(datetime.utcnow())
     
     if crime_types is None:
         crime_types = list(CRIME_TYPES_AREQUIPA.keys())
-    
-    for i in range(n):
-        # Generar coordenadas dentro de la zona
-        lat, lon = _generate_point_in_bounds(zone_bounds)
-        
-        # Seleccionar tipo de crimen
-        primary = random.choice(crime_types)
-        description = random.choice(CRIME_TYPES_AREQUIPA.get(primary, ['Incidente']))
-        
-        # Generar fecha aleatoria en los últimos días
-        days_ago = random.randint(0, days_back)
-        hours_ago = random.randint(0, 23)
-        minutes_ago = random.randint(0, 59)
-        record_date = now - timedelta(days=days_ago, hours=hours_ago, minutes=minutes_ago)
-        
-        row = {
-            'id': f'ARQ-{int(time.time()*1000)}-{i}',
-            'case_number': f'AQP{record_date.year}{i:06d}',
-            'date': record_date.isoformat(),
-            'block': f'{random.choice(["AV", "CALLE", "JR"])} {random.randint(100, 999)}',
-            'iucr': f'{random.randint(1000, 9999)}',
-            'primary_type': primary,
-            'description': description,
-            'location_description': random.choice(LOCATIONS_AREQUIPA),
-            'arrest': random.random() < 0.15,
-            'domestic': random.random() < 0.25 if primary == 'VIOLENCIA FAMILIAR' else random.random() < 0.05,
-            'beat': f'{random.randint(100, 999)}',
-            'district': f'{random.randint(1, 10):02d}',
-            'ward': f'{random.randint(1, 29)}',
-            'community_area': f'{random.randint(1, 77)}',
-            'fbi_code': None,
-            'year': record_date.year,
-            'updated_on': now.isoformat(),
-            'x_coordinate': None,
-            'y_coordinate': None,
-            'latitude': lat,
-            'longitude': lon,
-            'location': f'({lat}, {lon})'
-        }
-        rows.append(row)
-    
-    df = _records_to_dataframe(rows)
+
+    # Cada columna se genera con una sola llamada vectorizada
+    lats, lons = _generate_points_in_bounds(n, zone_bounds)
+    idx = pd.Series(np.arange(n)).astype(str)
+
+    # Seleccionar tipo de crimen y una descripción acorde a cada tipo
+    primary = _RNG.choice(np.asarray(crime_types, dtype=object), size=n)
+    description = np.empty(n, dtype=object)
+    for crime_type in set(primary):
+        rows = primary == crime_type
+        options = _DESC_LOOKUP.get(crime_type, _FALLBACK_DESC)
+        description[rows] = _RNG.choice(options, size=int(rows.sum()))
+
+    # Generar fechas aleatorias en los últimos días (resolución de minutos)
+    minutes_ago = _RNG.integers(0, (days_back + 1) * 24 * 60, size=n)
+    record_date = now - pd.to_timedelta(minutes_ago, unit='m')
+    years = pd.Series(record_date.year)
+
+    df = _normalize_dataframe(pd.DataFrame({
+        'id': f'ARQ-{int(time.time()*1000)}-' + idx,
+        'case_number': 'AQP' + years.astype(str) + idx.str.zfill(6),
+        'date': record_date,
+        'block': pd.Series(_RNG.choice(["AV", "CALLE", "JR"], size=n)) + ' ' + pd.Series(_RNG.integers(100, 1000, size=n)).astype(str),
+        'iucr': pd.Series(_RNG.integers(1000, 10000, size=n)).astype(str),
+        'primary_type': primary,
+        'description': description,
+        'location_description': _RNG.choice(np.asarray(LOCATIONS_AREQUIPA, dtype=object), size=n),
+        'arrest': _RNG.random(n) < 0.15,
+        'domestic': _RNG.random(n) < np.where(primary == 'VIOLENCIA FAMILIAR', 0.25, 0.05),
+        'beat': pd.Series(_RNG.integers(100, 1000, size=n)).astype(str),
+        'district': pd.Series(_RNG.integers(1, 11, size=n)).astype(str).str.zfill(2),
+        'ward': pd.Series(_RNG.integers(1, 30, size=n)).astype(str),
+        'community_area': pd.Series(_RNG.integers(1, 78, size=n)).astype(str),
+        'fbi_code': None,
+        'year': years,
+        'updated_on': now,
+        'x_coordinate': None,
+        'y_coordinate': None,
+        'latitude': lats,
+        'longitude': lons,
+        'location': '(' + pd.Series(lats).astype(str) + ', ' + pd.Series(lons).astype(str) + ')'
+    }))
     if store_in_session:
         # Almacenar los registros en la sesión como datos de Arequipa
         add_records_to_session(df, is_arequipa=True)
@@ -199,40 +267,37 @@ def generate_random_records_in_zone(
 
 def generate_random_records(n: int, base_lat: Optional[float] = None, base_lon: Optional[float] = None) -> pd.DataFrame:
     ##Versión original - genera registros aleatorios simples
-    rows = []
-    now = datetime.utcnow()
-    for i in range(n):
-        lat = None
-        lon = None
-        if base_lat is not None and base_lon is not None:
-            lat = base_lat + random.uniform(-0.01, 0.01)
-            lon = base_lon + random.uniform(-0.01, 0.01)
-        row = {
-            'id': f'fake-{int(time.time()*1000)}-{i}',
-            'case_number': f'FAKE{i:06d}',
-            'date': now.isoformat(),
-            'block': 'UNKNOWN',
-            'iucr': '0000',
-            'primary_type': random.choice(['THEFT', 'BATTERY', 'ROBBERY', 'CRIMINAL DAMAGE', 'ASSAULT']),
-            'description': 'Synthetic record for testing',
-            'location_description': 'RESIDENCE',
-            'arrest': random.choice([True, False]),
-            'domestic': random.choice([True, False]),
-            'beat': None,
-            'district': None,
-            'ward': None,
-            'community_area': None,
-            'fbi_code': None,
-            'year': now.year,
-            'updated_on': now.isoformat(),
-            'x_coordinate': None,
-            'y_coordinate': None,
-            'latitude': lat,
-            'longitude': lon,
-            'location': None
-        }
-        rows.append(row)
-    return _records_to_dataframe(rows)
+    now = pd.Timestamp(datetime.utcnow())
+    lat = None
+    lon = None
+    if base_lat is not None and base_lon is not None:
+        lat = base_lat + _RNG.uniform(-0.01, 0.01, size=n)
+        lon = base_lon + _RNG.uniform(-0.01, 0.01, size=n)
+    idx = pd.Series(np.arange(n)).astype(str)
+    return _normalize_dataframe(pd.DataFrame({
+        'id': f'fake-{int(time.time()*1000)}-' + idx,
+        'case_number': 'FAKE' + idx.str.zfill(6),
+        'date': now,
+        'block': 'UNKNOWN',
+        'iucr': '0000',
+        'primary_type': _RNG.choice(np.asarray(['THEFT', 'BATTERY', 'ROBBERY', 'CRIMINAL DAMAGE', 'ASSAULT'], dtype=object), size=n),
+        'description': 'Synthetic record for testing',
+        'location_description': 'RESIDENCE',
+        'arrest': _RNG.random(n) < 0.5,
+        'domestic': _RNG.random(n) < 0.5,
+        'beat': None,
+        'district': None,
+        'ward': None,
+        'community_area': None,
+        'fbi_code': None,
+        'year': now.year,
+        'updated_on': now,
+        'x_coordinate': None,
+        'y_coordinate': None,
+        'latitude': lat,
+        'longitude': lon,
+        'location': None
+    }, index=idx.index))
 
 
 def persist_dataframe_to_sqlite(df: pd.DataFrame, db_path: str = 'chicago.db', table: str = 'crimes') -> None:
@@ -251,9 +316,8 @@ def persist_dataframe_to_sqlite(df: pd.DataFrame, db_path: str = 'chicago.db', t
 
 def add_records_to_session(df: pd.DataFrame, is_arequipa: bool = False) -> None:
     if is_arequipa:
-        key = '_arequipa_records'
-        existing = st.session_state.get(key, pd.DataFrame(columns=SCHEMA_COLUMNS))
-        st.session_state[key] = pd.concat([df, existing], ignore_index=True)
+        # Solo se guarda el bloque nuevo; la concatenación se hace al leer
+        st.session_state.setdefault(AREQUIPA_CHUNKS_KEY, []).append(df)
     else:
         key_df = '_chicago_last_df'
         existing = st.session_state.get(key_df, pd.DataFrame(columns=SCHEMA_COLUMNS))
@@ -262,23 +326,21 @@ def add_records_to_session(df: pd.DataFrame, is_arequipa: bool = False) -> None:
 
 def get_arequipa_records() -> pd.DataFrame:
     """Obtiene los registros sintéticos de Arequipa almacenados en la sesión."""
-    return st.session_state.get('_arequipa_records', pd.DataFrame(columns=SCHEMA_COLUMNS))
-
-
-def clear_arequipa_records() -> None:
-    """Limpia los registros sintéticos de Arequipa de la sesión."""
-    if '_arequipa_records' in st.session_state:
-        del st.session_state['_arequipa_records']
-
-
-def get_arequipa_records() -> pd.DataFrame:
-    """Obtiene los registros sintéticos de Arequipa almacenados en la sesión."""
-    return st.session_state.get('_arequipa_records', pd.DataFrame(columns=SCHEMA_COLUMNS))
+    chunks = st.session_state.get(AREQUIPA_CHUNKS_KEY)
+    if not chunks:
+        return pd.DataFrame(columns=SCHEMA_COLUMNS)
+    # Reutilizar la concatenación mientras no se agreguen bloques nuevos
+    cached = st.session_state.get(AREQUIPA_DF_KEY)
+    if cached is not None and cached[0] == len(chunks):
+        return cached[1]
+    # Los bloques más recientes primero, igual que al insertarlos
+    df = pd.concat(chunks[::-1], ignore_index=True)
+    st.session_state[AREQUIPA_DF_KEY] = (len(chunks), df)
+    return df
 
 
 def clear_arequipa_records() -> None:
     """Limpia los registros sintéticos de Arequipa de la sesión."""
-    if '_arequipa_records' in st.session_state:
-        del st.session_state['_arequipa_records']
-
-
+    for key in (AREQUIPA_CHUNKS_KEY, AREQUIPA_DF_KEY):
+        if key in st.session_state:
+            del st.session_state[key]
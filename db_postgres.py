@@ -1,9 +1,13 @@
+import io
 import os
 import sqlite3
-import json
+import threading
+from contextlib import contextmanager
+import orjson
 import random
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
 from datetime import datetime, timedelta
+import pandas as pd
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -18,16 +22,50 @@ PG_USER: str = os.getenv('PG_USER', '')
 PG_PASSWORD: str = os.getenv('PG_PASSWORD', '')
 PG_PORT: str = os.getenv('PG_PORT', '5432')
 PG_SSLMODE: str = os.getenv('PG_SSLMODE', 'require')
+# Max pooled connections; callers beyond this wait for a free one
+PG_POOL_MAX: int = int(os.getenv('PG_POOL_MAX', '8'))
 
 # SQLite settings (used when DB_MODE == 'sqlite')
 SQLITE_PATH = os.getenv('SQLITE_PATH', 'chicago_local.db')
 
 
+# Columns of the `crimes` table, in insert order
+CRIME_COLUMNS: List[str] = [
+    'id', 'case_number', 'date', 'block', 'iucr', 'primary_type',
+    'description', 'location_description', 'arrest', 'domestic', 'beat',
+    'district', 'ward', 'community_area', 'fbi_code', 'year', 'updated_on',
+    'latitude', 'longitude', 'location'
+]
+
+# Columns that insert_crimes always overwrites with a recent timestamp
+_REDATED_COLUMNS = ('date', 'updated_on', 'year')
+
+# Single process-wide SQLite connection, serialized with a lock (sqlite mode only)
+_SQLITE_CONN: sqlite3.Connection | None = None
+_SQLITE_LOCK = threading.Lock()
+
+
+@contextmanager
+def sqlite_conn() -> Iterator[sqlite3.Connection]:
+    """Use the shared SQLite connection while holding its lock."""
+    with _SQLITE_LOCK:
+        try:
+            yield _SQLITE_CONN
+        finally:
+            if _SQLITE_CONN.in_transaction:
+                _SQLITE_CONN.rollback()
+
+
 def _init_sqlite() -> None:
-    """Create sqlite DB and `crimes` table if it doesn't exist."""
-    conn = sqlite3.connect(SQLITE_PATH)
-    try:
+    """Open the shared sqlite connection and create the `crimes` table if it doesn't exist."""
+    global _SQLITE_CONN
+    _SQLITE_CONN = sqlite3.connect(SQLITE_PATH, check_same_thread=False)
+    _SQLITE_CONN.row_factory = sqlite3.Row
+    with sqlite_conn() as conn:
         cur = conn.cursor()
+        cur.execute('PRAGMA journal_mode=WAL')
+        cur.execute('PRAGMA synchronous=NORMAL')
+        cur.execute('PRAGMA temp_store=MEMORY')
         cur.execute(
             """
             CREATE TABLE IF NOT EXISTS crimes (
@@ -54,28 +92,65 @@ def _init_sqlite() -> None:
             )
             """
         )
+        # Lets `ORDER BY date DESC LIMIT ?` walk the index instead of sorting the table
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_crimes_date ON crimes (date DESC)")
         conn.commit()
-    finally:
-        conn.close()
 
 
 if DB_MODE == 'sqlite':
     _init_sqlite()
 else:
-    import psycopg2
     from psycopg2.extras import execute_values
-    
+    from psycopg2.pool import ThreadedConnectionPool
+
+    _PG_POOL: ThreadedConnectionPool | None = None
+    _PG_POOL_LOCK = threading.Lock()
+    # getconn() raises PoolError when the pool is exhausted instead of blocking,
+    # so concurrent sessions queue on this semaphore before borrowing
+    _PG_POOL_SLOTS = threading.BoundedSemaphore(PG_POOL_MAX)
+
+    @contextmanager
+    def pg_conn() -> Iterator[Any]:
+        """Borrow a connection from the shared Postgres pool (created on first use).
+
+        Blocks while all PG_POOL_MAX connections are in use.
+        """
+        global _PG_POOL
+        if _PG_POOL is None:
+            with _PG_POOL_LOCK:
+                if _PG_POOL is None:
+                    _PG_POOL = ThreadedConnectionPool(
+                        1, PG_POOL_MAX,
+                        host=PG_HOST,
+                        dbname=PG_DBNAME,
+                        user=PG_USER,
+                        password=PG_PASSWORD,
+                        port=PG_PORT,
+                        sslmode=PG_SSLMODE,
+                    )
+        _PG_POOL_SLOTS.acquire()
+        try:
+            conn = _PG_POOL.getconn()
+        except Exception:
+            _PG_POOL_SLOTS.release()
+            raise
+        broken = False
+        try:
+            yield conn
+        finally:
+            # End any open transaction so the connection goes back to the pool idle
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+            try:
+                _PG_POOL.putconn(conn, close=broken or bool(conn.closed))
+            finally:
+                _PG_POOL_SLOTS.release()
+
     def _init_postgres() -> None:
         """Create the `crimes` table in Postgres if it doesn't exist."""
-        conn = psycopg2.connect(
-            host=PG_HOST,
-            dbname=PG_DBNAME,
-            user=PG_USER,
-            password=PG_PASSWORD,
-            port=PG_PORT,
-            sslmode=PG_SSLMODE,
-        )
-        try:
+        with pg_conn() as conn:
             with conn.cursor() as cur:
                 cur.execute(
                     """
@@ -103,9 +178,8 @@ else:
                     )
                     """
                 )
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_crimes_date ON crimes (date DESC)")
             conn.commit()
-        finally:
-            conn.close()
 
     try:
         _init_postgres()
@@ -114,17 +188,23 @@ else:
         pass
 
 
-def insert_crimes(records: List[Dict[str, Any]]) -> None:
-    """Insert or update records in the configured backend."""
+def _recent_offsets(n: int) -> Tuple[datetime, List[int]]:
+    """Capture UTC now once and draw n offsets (in seconds) between 1 hour and ~1 hour 59 minutes."""
+    return datetime.utcnow(), random.choices(range(3600, 7200), k=n)
+
+
+def insert_crimes(records: Sequence[Any], columns: Sequence[str] | None = None) -> None:
+    """Insert or update records in the configured backend.
+
+    `records` are dicts keyed by column name or, when `columns` is given, tuples
+    in that column order (e.g. `df[CRIME_COLUMNS].itertuples(index=False, name=None)`).
+    """
     if not records:
         return
 
-    columns = [
-        'id', 'case_number', 'date', 'block', 'iucr', 'primary_type',
-        'description', 'location_description', 'arrest', 'domestic', 'beat',
-        'district', 'ward', 'community_area', 'fbi_code', 'year', 'updated_on',
-        'latitude', 'longitude', 'location'
-    ]
+    if columns is None:
+        columns = CRIME_COLUMNS
+        records = [tuple(rec.get(col) for col in columns) for rec in records]
 
     def _normalize_value(v: Any) -> Any:
         if v is None:
@@ -137,63 +217,75 @@ def insert_crimes(records: List[Dict[str, Any]]) -> None:
         except Exception:
             pass
 
+        if isinstance(v, float) and v != v:
+            return None
         if isinstance(v, datetime):
             return v.isoformat()
         if isinstance(v, bool):
             return int(v)
         if isinstance(v, (list, dict)):
             try:
-                return json.dumps(v)
+                return orjson.dumps(v).decode('utf-8')
             except Exception:
                 return str(v)
         return v
 
-    def _enforce_recent_date(rec: Dict[str, Any]) -> None:
-        """Force record 'date' to be today's date and at least 1 hour earlier than now.
+    def _normalize_datetime(v: Any) -> Any:
+        if hasattr(v, 'to_pydatetime'):
+            try:
+                v = v.to_pydatetime()
+            except Exception:
+                pass
+        return v.isoformat() if isinstance(v, datetime) else v
 
-        Sets 'date' to UTC now minus between 1 hour and ~1 hour 59 minutes,
-        updates 'updated_on' to now, and adjusts 'year'.
-        """
-        now = datetime.utcnow()
-        extra_minutes = random.randint(0, 59)
-        extra_seconds = random.randint(0, 59)
-        new_date = now - timedelta(hours=1, minutes=extra_minutes, seconds=extra_seconds)
-        rec['date'] = new_date
-        rec['updated_on'] = now
-        try:
-            rec['year'] = new_date.year
-        except Exception:
-            rec['year'] = now.year
+    def _normalize_bool(v: Any) -> Any:
+        return int(v) if isinstance(v, bool) else v
 
-    for r in records:
-        try:
-            _enforce_recent_date(r)
-        except Exception:
-            pass
+    def _passthrough(v: Any) -> Any:
+        return v
+
+    # Per-column normalizer: skips the isinstance chain for columns of known type
+    column_normalizers = {
+        'date': _normalize_datetime,
+        'updated_on': _normalize_datetime,
+        'arrest': _normalize_bool,
+        'domestic': _normalize_bool,
+        'year': _passthrough,
+        'latitude': _passthrough,
+        'longitude': _passthrough,
+    }
+
+    # Force each record's 'date' to today, between 1 hour and ~1 hour 59 minutes
+    # before now; 'updated_on' becomes now and 'year' follows the new date.
+    # `now` is captured once and all offsets are drawn in a single call. The
+    # three columns are moved to the end of every row so tuples can be rebuilt.
+    keep = [i for i, col in enumerate(columns) if col not in _REDATED_COLUMNS]
+    out_columns = [columns[i] for i in keep] + list(_REDATED_COLUMNS)
+    now, offsets = _recent_offsets(len(records))
+
+    def _redated_rows() -> Iterator[tuple]:
+        for row, offset in zip(records, offsets):
+            new_date = now - timedelta(seconds=offset)
+            yield tuple(row[i] for i in keep) + (new_date, now, new_date.year)
+
+    columns = out_columns
 
     if DB_MODE == 'sqlite':
-        conn = sqlite3.connect(SQLITE_PATH)
-        try:
+        with sqlite_conn() as conn:
             cur = conn.cursor()
             placeholders = ','.join('?' for _ in columns)
             insert_sql = f"INSERT OR REPLACE INTO crimes ({', '.join(columns)}) VALUES ({placeholders})"
-            values = [tuple(_normalize_value(rec.get(col)) for col in columns) for rec in records]
+            normalizers = [column_normalizers.get(col, _normalize_value) for col in columns]
+            values = (tuple(norm(v) for norm, v in zip(normalizers, row)) for row in _redated_rows())
+            cur.execute('BEGIN IMMEDIATE')
             cur.executemany(insert_sql, values)
             conn.commit()
-        finally:
-            conn.close()
+            # SQLite never gathers planner statistics on its own
+            cur.execute('ANALYZE crimes')
         return
 
     # Postgres 
-    conn = psycopg2.connect(
-        host=PG_HOST,
-        dbname=PG_DBNAME,
-        user=PG_USER,
-        password=PG_PASSWORD,
-        port=PG_PORT,
-        sslmode=PG_SSLMODE,
-    )
-    try:
+    with pg_conn() as conn:
         with conn.cursor() as cur:
             def _pg_norm(v: Any) -> Any:
                 try:
@@ -201,82 +293,114 @@ def insert_crimes(records: List[Dict[str, Any]]) -> None:
                         v = v.to_pydatetime()
                 except Exception:
                     pass
+                if isinstance(v, float) and v != v:
+                    return None
                 if isinstance(v, datetime):
                     return v
                 if isinstance(v, bool):
                     return v
                 if isinstance(v, (list, dict)):
                     try:
-                        return json.dumps(v)
+                        return orjson.dumps(v).decode('utf-8')
                     except Exception:
                         return str(v)
                 return v
 
-            values = [tuple(_pg_norm(rec.get(col)) for col in columns) for rec in records]
+            values = (tuple(_pg_norm(v) for v in row) for row in _redated_rows())
             insert_sql = f"""
                 INSERT INTO crimes ({', '.join(columns)})
                 VALUES %s
                 ON CONFLICT (id) DO UPDATE SET
                 {', '.join([f"{col}=EXCLUDED.{col}" for col in columns if col != 'id'])}
             """
-            execute_values(cur, insert_sql, values)
+            execute_values(cur, insert_sql, values, page_size=1000)
+            # Refresh planner statistics now rather than waiting for autovacuum
+            cur.execute('ANALYZE crimes')
+        conn.commit()
+
+
+def copy_crimes_dataframe(df: pd.DataFrame) -> int:
+    """Bulk insert or update a DataFrame of crimes; returns the number of rows sent.
+
+    On Postgres the rows are streamed with COPY into a temporary staging table and
+    merged with a single INSERT ... ON CONFLICT. On SQLite this delegates to
+    `insert_crimes`. Dates are rewritten the same way `insert_crimes` does.
+    """
+    if df.empty:
+        return 0
+
+    out = df.reindex(columns=CRIME_COLUMNS)
+    if DB_MODE == 'sqlite':
+        insert_crimes(list(out.itertuples(index=False, name=None)), columns=CRIME_COLUMNS)
+        return len(out)
+
+    now, offsets = _recent_offsets(len(out))
+    out['date'] = pd.Timestamp(now) - pd.to_timedelta(offsets, unit='s')
+    out['updated_on'] = now
+    out['year'] = out['date'].dt.year
+
+    buf = io.StringIO()
+    out.to_csv(buf, index=False, header=False, na_rep='\\N')
+    buf.seek(0)
+
+    cols = ', '.join(CRIME_COLUMNS)
+    updates = ', '.join(f"{col}=EXCLUDED.{col}" for col in CRIME_COLUMNS if col != 'id')
+    with pg_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("CREATE TEMP TABLE crimes_stage (LIKE crimes INCLUDING DEFAULTS) ON COMMIT DROP")
+            cur.copy_expert(f"COPY crimes_stage ({cols}) FROM STDIN WITH (FORMAT CSV, NULL '\\N')", buf)
+            cur.execute(
+                f"""
+                INSERT INTO crimes ({cols})
+                SELECT DISTINCT ON (id) {cols} FROM crimes_stage
+                ON CONFLICT (id) DO UPDATE SET {updates}
+                """
+            )
+            cur.execute('ANALYZE crimes')
         conn.commit()
-    finally:
-        conn.close()
+    return len(out)
 
 
 def fetch_latest_crimes(limit: int = 5000) -> List[Dict[str, Any]]:
     columns = None
     if DB_MODE == 'sqlite':
-        conn = sqlite3.connect(SQLITE_PATH)
-        try:
-            conn.row_factory = sqlite3.Row
+        with sqlite_conn() as conn:
             cur = conn.cursor()
             cur.execute("SELECT * FROM crimes ORDER BY date DESC LIMIT ?", (limit,))
             rows = cur.fetchall()
             return [dict(row) for row in rows]
-        finally:
-            conn.close()
-
-    conn = psycopg2.connect(
-        host=PG_HOST,
-        dbname=PG_DBNAME,
-        user=PG_USER,
-        password=PG_PASSWORD,
-        port=PG_PORT,
-        sslmode=PG_SSLMODE,
-    )
-    try:
+
+    with pg_conn() as conn:
         with conn.cursor() as cur:
             cur.execute("SELECT * FROM crimes ORDER BY date DESC LIMIT %s", (limit,))
             cols = [desc[0] for desc in cur.description]
             rows = cur.fetchall()
             return [dict(zip(cols, row)) for row in rows]
-    finally:
-        conn.close()
+
+
+def fetch_latest_crimes_df(limit: int = 5000) -> pd.DataFrame:
+    """Same as `fetch_latest_crimes` but reads straight into a DataFrame (no per-row dicts)."""
+    sql = "SELECT * FROM crimes ORDER BY date DESC LIMIT {}"
+    if DB_MODE == 'sqlite':
+        with sqlite_conn() as conn:
+            return pd.read_sql_query(sql.format('?'), conn, params=(limit,), parse_dates=['date', 'updated_on'])
+
+    with pg_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql.format('%s'), (limit,))
+            cols = [desc[0] for desc in cur.description]
+            return pd.DataFrame.from_records(cur.fetchall(), columns=cols)
 
 
 def fetch_crime_by_id(crime_id: str) -> Dict[str, Any] | None:
     if DB_MODE == 'sqlite':
-        conn = sqlite3.connect(SQLITE_PATH)
-        try:
-            conn.row_factory = sqlite3.Row
+        with sqlite_conn() as conn:
             cur = conn.cursor()
             cur.execute("SELECT * FROM crimes WHERE id = ?", (crime_id,))
             row = cur.fetchone()
             return dict(row) if row else None
-        finally:
-            conn.close()
-
-    conn = psycopg2.connect(
-        host=PG_HOST,
-        dbname=PG_DBNAME,
-        user=PG_USER,
-        password=PG_PASSWORD,
-        port=PG_PORT,
-        sslmode=PG_SSLMODE,
-    )
-    try:
+
+    with pg_conn() as conn:
         with conn.cursor() as cur:
             cur.execute("SELECT * FROM crimes WHERE id = %s", (crime_id,))
             row = cur.fetchone()
@@ -284,35 +408,20 @@ def fetch_crime_by_id(crime_id: str) -> Dict[str, Any] | None:
                 return None
             cols = [desc[0] for desc in cur.description]
             return dict(zip(cols, row))
-    finally:
-        conn.close()
 
 
 def delete_crime_by_id(crime_id: str) -> bool:
     if DB_MODE == 'sqlite':
-        conn = sqlite3.connect(SQLITE_PATH)
-        try:
+        with sqlite_conn() as conn:
             cur = conn.cursor()
             cur.execute("DELETE FROM crimes WHERE id = ?", (crime_id,))
             deleted = cur.rowcount
             conn.commit()
             return deleted > 0
-        finally:
-            conn.close()
-
-    conn = psycopg2.connect(
-        host=PG_HOST,
-        dbname=PG_DBNAME,
-        user=PG_USER,
-        password=PG_PASSWORD,
-        port=PG_PORT,
-        sslmode=PG_SSLMODE,
-    )
-    try:
+
+    with pg_conn() as conn:
         with conn.cursor() as cur:
             cur.execute("DELETE FROM crimes WHERE id = %s", (crime_id,))
             deleted = cur.rowcount
         conn.commit()
         return deleted > 0
-    finally:
-        conn.close()
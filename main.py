@@ -9,6 +9,7 @@ y conexión a base de datos PostgreSQL.
 @returns Inicializa y ejecuta la aplicación principal de Streamlit.
 """
 import streamlit as st
+import numpy as np
 import pandas as pd
 import requests
 from typing import Any, Tuple
@@ -16,15 +17,23 @@ try:
     import CHICAGO.data as data_module
     from CHICAGO.viz import show_primary_type_bar, show_map_points_and_heat, show_additional_charts
     from CHICAGO.auth import admin_login_ui, admin_logout
-    from CHICAGO.db_postgres import insert_crimes
+    from CHICAGO.db_postgres import insert_crimes, copy_crimes_dataframe, CRIME_COLUMNS, DB_MODE
 except Exception:
     import data as data_module
     from viz import show_primary_type_bar, show_map_points_and_heat, show_additional_charts
     from auth import admin_login_ui, admin_logout
-    from db_postgres import insert_crimes
+    from db_postgres import insert_crimes, copy_crimes_dataframe, CRIME_COLUMNS, DB_MODE
 import inspect
 
+# Funciones del módulo de datos resueltas una sola vez al importar
+_GEN_IN_ZONE = getattr(data_module, 'generate_random_records_in_zone', None)
+_GEN = getattr(data_module, 'generate_random_records')
+_FETCH = getattr(data_module, 'fetch_latest')
+_PERSIST = getattr(data_module, 'persist_dataframe_to_sqlite', None)
+
 DEFAULT_LIMIT: int = 5000
+# Filas enviadas al navegador en la tabla de datos
+N_VISIBLE: int = 500
 
 # Definición de zonas de Arequipa con sus coordenadas
 AREQUIPA_ZONES: dict[str, dict[str, Any]] = {
@@ -47,6 +56,46 @@ AREQUIPA_ZONES: dict[str, dict[str, Any]] = {
         "center": (-16.395, -71.545)
     }
 }
+AREQUIPA_ZONE_NAMES: Tuple[str, ...] = tuple(AREQUIPA_ZONES.keys())
+
+_CRIME_TYPE_OPTIONS: Tuple[str, ...] = ('ROBO', 'ASALTO', 'HURTO', 'VANDALISMO', 'VIOLENCIA FAMILIAR')
+
+
+#Huella del contenido del DataFrame, calculada una sola vez por objeto.
+
+#Se guarda en la sesión junto al DataFrame del que proviene, de modo que los
+#reruns que reciben el mismo objeto no vuelven a hashear todas las columnas.
+
+def _df_fingerprint(df: pd.DataFrame) -> int:
+    cached = st.session_state.get('_df_fp')
+    if cached is not None and cached[0] is df:
+        return cached[1]
+    df_fp = int(pd.util.hash_pandas_object(df, index=False).sum())
+    st.session_state['_df_fp'] = (df, df_fp)
+    return df_fp
+
+
+#Serializa el DataFrame a CSV una sola vez por contenido.
+
+#El parámetro `_df` no se hashea (prefijo `_`); la clave de caché es `df_fp`.
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _df_to_csv_bytes(df_fp: int, _df: pd.DataFrame) -> bytes:
+    return _df.to_csv(index=False).encode('utf-8')
+
+
+#Cuenta los valores nulos por columna una sola vez por contenido y filtros aplicados.
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _null_summary(df_fp: int, filters: tuple, _df: pd.DataFrame) -> pd.Series:
+    return _df.isnull().sum()
+
+
+#Valores distintos de primary_type para el filtro, una sola vez por contenido del DataFrame.
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _unique_types(df_fp: int, _s: pd.Series) -> list:
+    return list(_s.dropna().unique())
 
 
 #Panel de control del administrador.
@@ -70,7 +119,7 @@ def admin_panel() -> Tuple[str, dict[str, Any]]:
     # Selección de zona
     zone_name = st.sidebar.selectbox(
         "Zona de Arequipa",
-        options=list(AREQUIPA_ZONES.keys())
+        options=AREQUIPA_ZONE_NAMES
     )
     
     zone_info = AREQUIPA_ZONES[zone_name]
@@ -86,23 +135,21 @@ def admin_panel() -> Tuple[str, dict[str, Any]]:
     )
     crime_types = st.sidebar.multiselect(
         "Tipos de crimen",
-        options=['ROBO', 'ASALTO', 'HURTO', 'VANDALISMO', 'VIOLENCIA FAMILIAR'],
+        options=_CRIME_TYPE_OPTIONS,
         default=['ROBO', 'ASALTO', 'HURTO']
     )
     if st.sidebar.button('🎲 Generar Datos en Zona (PostgreSQL)'):
         try:
             # Generar datos sintéticos en la zona seleccionada
-            if hasattr(data_module, 'generate_random_records_in_zone'):
-                gen_fn = getattr(data_module, 'generate_random_records_in_zone')
-                synth = gen_fn(n=int(inject_count), zone_bounds=zone_info["bounds"], crime_types=crime_types if crime_types else None)
+            if _GEN_IN_ZONE is not None:
+                synth = _GEN_IN_ZONE(n=int(inject_count), zone_bounds=zone_info["bounds"], crime_types=crime_types if crime_types else None)
             else:
-                gen_fn = getattr(data_module, 'generate_random_records')
-                synth = gen_fn(int(inject_count))
+                synth = _GEN(int(inject_count))
             
-            # Insertar en base de datos (Postgres o SQLite según DB_MODE)
-            records = synth.to_dict(orient='records')
-            insert_crimes(records)
-            st.sidebar.success(f'{len(records)} registros generados e insertados en base de datos')
+            # Insertar en base de datos (Postgres o SQLite según DB_MODE) como tuplas por columna
+            rows = list(synth[CRIME_COLUMNS].itertuples(index=False, name=None))
+            insert_crimes(rows, columns=CRIME_COLUMNS)
+            st.sidebar.success(f'{len(rows)} registros generados e insertados en base de datos')
         except Exception as e:
             st.sidebar.error(f'Error al generar/insertar: {e}')
     
@@ -110,10 +157,20 @@ def admin_panel() -> Tuple[str, dict[str, Any]]:
     st.sidebar.markdown("### 🔄 Actualizar Base de Datos")
     if st.sidebar.button('Actualizar con últimos 5000 de Chicago (PostgreSQL)'):
         try:
-            df_chicago = data_module.fetch_latest(limit=5000)
-            records = df_chicago.to_dict(orient='records')
-            insert_crimes(records)
-            st.sidebar.success(f'Se insertaron/actualizaron {len(records)} registros en PostgreSQL')
+            df_chicago = _FETCH(limit=5000)
+            if DB_MODE == 'sqlite':
+                # En SQLite copy_crimes_dataframe ya es insert_crimes: sin reintento
+                count = copy_crimes_dataframe(df_chicago)
+            else:
+                try:
+                    # Carga masiva con COPY
+                    count = copy_crimes_dataframe(df_chicago)
+                except Exception as e:
+                    st.sidebar.warning(f'COPY falló ({e}); insertando por lotes')
+                    rows = list(df_chicago[CRIME_COLUMNS].itertuples(index=False, name=None))
+                    insert_crimes(rows, columns=CRIME_COLUMNS)
+                    count = len(rows)
+            st.sidebar.success(f'Se insertaron/actualizaron {count} registros en PostgreSQL')
         except Exception as e:
             st.sidebar.error(f'Error al actualizar base: {e}')
     
@@ -127,8 +184,7 @@ def admin_panel() -> Tuple[str, dict[str, Any]]:
             df = st.session_state.get('_chicago_last_df', pd.DataFrame())       
             if not df.empty:
                 try:
-                    persist_fn = getattr(data_module, 'persist_dataframe_to_sqlite')
-                    persist_fn(df)
+                    _PERSIST(df)
                     st.sidebar.success(' Guardado')
                 except Exception as e:
                     st.sidebar.error(f'Error al guardar: {e}')
@@ -138,11 +194,26 @@ def admin_panel() -> Tuple[str, dict[str, Any]]:
     with col2:
         if col2.button('Limpiar'):
             import os
+            import sqlite3
             try:
-                os.remove('chicago.db')
-                st.sidebar.success(' DB eliminada')
+                if not os.path.exists('chicago.db'):
+                    raise FileNotFoundError('chicago.db')
+                # Vaciar la tabla en lugar de borrar el archivo: funciona aunque
+                # otra conexión lo tenga abierto (Windows bloquea os.remove)
+                conn = sqlite3.connect('chicago.db')
+                try:
+                    conn.executescript('DELETE FROM crimes; VACUUM;')
+                finally:
+                    conn.close()
+                st.sidebar.success(' DB vaciada')
             except FileNotFoundError:
                 st.sidebar.info('No existe DB')
+            except sqlite3.OperationalError as e:
+                # Solo la tabla inexistente es informativa; 'database is locked' y demás son errores
+                if 'no such table' in str(e):
+                    st.sidebar.info('No hay tabla de crímenes')
+                else:
+                    st.sidebar.error(f'Error: {e}')
             except Exception as e:
                 st.sidebar.error(f'Error: {e}')
     
@@ -152,7 +223,7 @@ def admin_panel() -> Tuple[str, dict[str, Any]]:
     
     df = st.session_state.get('_chicago_last_df', pd.DataFrame())
     if not df.empty:
-        csv = df.to_csv(index=False).encode('utf-8')
+        csv = _df_to_csv_bytes(_df_fingerprint(df), df)
         st.sidebar.download_button(
             label="Descargar CSV",
             data=csv,
@@ -224,90 +295,100 @@ def app() -> None:
             force_refresh = False
     
     # Obtener datos actualizados
-    fetch_fn = getattr(data_module, 'fetch_latest')
-    df = fetch_fn(
+    df = _FETCH(
         limit=int(limit),
         force=force_refresh,
         refresh_interval=60 if auto_refresh else 999999
     )
+    # Una sola huella por rerun, reutilizada como clave por todas las cachés
+    df_fp = _df_fingerprint(df)
     
-    # Mostrar métricas principales
+    # Mostrar métricas principales (una sola agregación para todas)
+    aggs = df.reindex(columns=['arrest', 'domestic', 'date']).agg({'arrest': 'sum', 'domestic': 'sum', 'date': 'max'})
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
         st.metric("Total Registros", len(df))
     
     with col2:
-        if 'date' in df.columns and not df['date'].isna().all():
-            latest = df['date'].max()
-            st.metric("Último Reporte", latest.strftime('%d/%m/%Y %H:%M') if pd.notna(latest) else 'N/A')
-        else:
-            st.metric("Último Reporte", "N/A")
+        latest = aggs['date']
+        st.metric("Último Reporte", latest.strftime('%d/%m/%Y %H:%M') if pd.notna(latest) else 'N/A')
     
     with col3:
-        arrests = df['arrest'].sum() if 'arrest' in df.columns else 0
-        st.metric("Arrestos", int(arrests))
+        st.metric("Arrestos", int(aggs['arrest']))
     
     with col4:
-        domestic = df['domestic'].sum() if 'domestic' in df.columns else 0
-        st.metric("Domésticos", int(domestic))
+        st.metric("Domésticos", int(aggs['domestic']))
     
     # Secciones con pestañas (mapa, estadísticas, datos)
     tab1, tab2, tab3 = st.tabs(["Mapa", "Estadísticas", "Datos"])
     
     with tab1:
         st.subheader(f"Mapa de Incidentes - {zone_name}")
-        show_map_points_and_heat(df, heat_threshold=30)
+        show_map_points_and_heat(df, heat_threshold=30, df_fp=df_fp)
     
     with tab2:
         col1, col2 = st.columns(2)
         with col1:
-            show_primary_type_bar(df)
+            show_primary_type_bar(df, df_fp=df_fp)
         with col2:
-            show_additional_charts(df)
+            show_additional_charts(df, df_fp=df_fp)
     
     with tab3:
         st.subheader("Tabla de Datos")
         
         # Filtros interactivos
+        types = []
+        show_arrests = False
         col1, col2 = st.columns(2)
         with col1:
             if 'primary_type' in df.columns:
                 types = st.multiselect(
                     "Filtrar por tipo",
-                    options=df['primary_type'].dropna().unique(),
+                    options=_unique_types(df_fp, df['primary_type']),
                     default=None
                 )
-                if types:
-                    df = df[df['primary_type'].isin(types)]
         
         with col2:
             if 'arrest' in df.columns:
                 show_arrests = st.checkbox("Solo con arresto", value=False)
-                if show_arrests:
-                    df = df[df['arrest'] == True]
         
+        # Un solo filtrado con la máscara combinada en lugar de dos copias encadenadas
+        if types or show_arrests:
+            mask = np.ones(len(df), dtype=bool)
+            if types:
+                mask &= df['primary_type'].isin(types).to_numpy()
+            if show_arrests:
+                mask &= df['arrest'].to_numpy(dtype=bool)
+            df = df.loc[mask]
+        
+        # Enviar solo las primeras N_VISIBLE filas salvo que se pida la tabla completa:
+        # con miles de filas pesa MB en el websocket
+        shown = df
+        if len(df) > N_VISIBLE and not st.checkbox(f"Mostrar las {len(df)} filas", value=False, key='_show_all_rows'):
+            shown = df.head(N_VISIBLE)
+        st.caption(f'Mostrando {len(shown)} de {len(df)}')
+
         # Ajustar la altura de la tabla para mostrar más filas generadas
-        try:
-            rows_count = len(df)
-        except Exception:
-            rows_count = 0
+        rows_count = len(shown)
         per_row_px = 32
         max_height = 1200
         min_height = 400
         desired_height = min(max_height, max(min_height, per_row_px * rows_count + 140))
 
         st.dataframe(
-            df,
+            shown,
             height=int(desired_height)
         )
         
         # Información técnica solo visible para admin
         if is_admin:
-            with st.expander("ℹ️ Información Técnica"):
+            with st.expander("ℹ️ Información Técnica", expanded=False):
                 st.write("**Columnas disponibles:**", list(df.columns))
-                st.write("**Registros nulos por columna:**")
-                st.write(df.isnull().sum())
+                # El cuerpo del expander se ejecuta aunque esté cerrado: el conteo solo bajo demanda
+                if st.checkbox("Mostrar registros nulos por columna", value=False):
+                    st.write("**Registros nulos por columna:**")
+                    st.write(_null_summary(df_fp, (tuple(types), show_arrests), df))
 
 
 if __name__ == '__main__':
@@ -1,12 +1,14 @@
 """"Muestra un gráfico de barras con el conteo de delitos por tipo principal.
 
 @param df DataFrame que contiene los registros de crímenes, incluyendo la columna 'primary_type'.
+@param df_fp Huella del contenido de `df` ya calculada por el llamador; si falta, se hashea la columna.
 
 @returns None. Muestra el gráfico directamente en Streamlit.
 """
 import streamlit as st
+import numpy as np
 import pandas as pd
-from typing import Any
+from typing import Any, Optional
 try:
     import pydeck as pdk
     PDK_AVAILABLE: bool = True
@@ -14,9 +16,47 @@ except Exception:
     PDK_AVAILABLE: bool = False
 
 
-def show_primary_type_bar(df: pd.DataFrame) -> None:
+@st.cache_data(show_spinner=False, max_entries=32)
+def _value_counts(df_fp: int, column: str, _series: pd.Series) -> pd.Series:
+    # La clave es (df_fp, column): `_series` no se hashea en cada rerun
+    # Las columnas categóricas necesitan 'UNKNOWN' como categoría antes de fillna
+    series = _series
+    if isinstance(series.dtype, pd.CategoricalDtype) and 'UNKNOWN' not in series.cat.categories:
+        series = series.cat.add_categories('UNKNOWN')
+    counts = series.fillna('UNKNOWN').value_counts()
+    counts = counts[counts > 0]
+    counts.index = counts.index.astype(object)
+    return counts
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def _build_deck(key: int, _pts: pd.DataFrame) -> Any:
+    # El Deck no se serializa bien con cache_data; cache_resource devuelve la misma
+    # instancia mientras `key` (huella del contenido de `_pts` o de su origen) no cambie
+    view_state = pdk.ViewState(latitude=_pts['lat'].mean(), longitude=_pts['lon'].mean(), zoom=10, pitch=40)
+    hex_layer = pdk.Layer(
+        "HexagonLayer",
+        data=_pts,
+        get_position='[lon, lat]',
+        radius=200,
+        elevation_scale=50,
+        elevation_range=[0, 3000],
+        pickable=True,
+        extruded=True,
+    )
+    return pdk.Deck(layers=[hex_layer], initial_view_state=view_state, tooltip={"text": "# of incidents: {position} (hover for details)"})
+
+
+def _column_counts(df: pd.DataFrame, column: str, df_fp: Optional[int]) -> pd.Series:
+    # Sin huella del llamador se hashea solo la columna pedida
+    series = df[column]
+    key = df_fp if df_fp is not None else int(pd.util.hash_pandas_object(series, index=False).sum())
+    return _value_counts(key, column, series)
+
+
+def show_primary_type_bar(df: pd.DataFrame, df_fp: Optional[int] = None) -> None:
     st.subheader('Conteo por Primary Type')
-    counts = df['primary_type'].fillna('UNKNOWN').value_counts().rename_axis('primary_type').reset_index(name='counts')
+    counts = _column_counts(df, 'primary_type', df_fp).rename_axis('primary_type').reset_index(name='counts')
     st.bar_chart(counts.set_index('primary_type'))
 
 
@@ -24,50 +64,46 @@ def show_primary_type_bar(df: pd.DataFrame) -> None:
 
 @param df DataFrame con coordenadas de delitos (columnas 'latitude' y 'longitude').
 @param heat_threshold Umbral mínimo de incidentes para considerar una zona como punto caliente.
+@param df_fp Huella del contenido de `df` ya calculada por el llamador; si falta, se hashean las coordenadas.
 
 @returns None. Muestra el mapa directamente en Streamlit.
 """
-def show_map_points_and_heat(df: pd.DataFrame, heat_threshold: int = 50) -> None:
+def show_map_points_and_heat(df: pd.DataFrame, heat_threshold: int = 50, df_fp: Optional[int] = None) -> None:
     st.subheader('Mapa de puntos y calor')
-    mdf = df.dropna(subset=['latitude', 'longitude']).copy()
+    # Un único DataFrame con solo las coordenadas, reutilizado por todos los mapas
+    mdf = df[['latitude', 'longitude']].dropna().rename(columns={'latitude': 'lat', 'longitude': 'lon'})
     if mdf.empty:
         st.info('No hay coordenadas válidas para mostrar')
         return
 
-    #  map
-    st.map(mdf.rename(columns={'latitude': 'lat', 'longitude': 'lon'})[['lat', 'lon']])
-
-    # agregación por hex para detectar hotspots
+    # Un solo mapa por rama: hexágonos con pydeck o, si no se puede, el mapa básico
     if PDK_AVAILABLE:
         try:
             # usa pydeck HexagonLayer
-            view_state = pdk.ViewState(latitude=mdf['latitude'].mean(), longitude=mdf['longitude'].mean(), zoom=10, pitch=40)
-            hex_layer = pdk.Layer(
-                "HexagonLayer",
-                data=mdf[['latitude', 'longitude']].rename(columns={'latitude': 'lat', 'longitude': 'lon'}),
-                get_position='[lon, lat]',
-                radius=200,
-                elevation_scale=50,
-                elevation_range=[0, 3000],
-                pickable=True,
-                extruded=True,
-            )
-
-            r = pdk.Deck(layers=[hex_layer], initial_view_state=view_state, tooltip={"text": "# of incidents: {position} (hover for details)"})
+            key = df_fp if df_fp is not None else int(pd.util.hash_pandas_object(mdf, index=False).sum())
+            r = _build_deck(key, mdf)
             st.pydeck_chart(r)
         except Exception as e:
             st.write('No se pudo generar mapa avanzado con pydeck:', e)
+            st.map(mdf)
     else:
         st.info('pydeck no está disponible: mostrando mapa básico')
-        st.map(mdf.rename(columns={'latitude': 'lat', 'longitude': 'lon'})[['lat', 'lon']])
+        st.map(mdf)
 
     try:
-        bins = mdf.copy()
-        bins['lat_bin'] = bins['latitude'].round(2)
-        bins['lon_bin'] = bins['longitude'].round(2)
-        grouped = bins.groupby(['lat_bin', 'lon_bin']).size().reset_index(name='count')
-        hotspots = grouped[grouped['count'] > heat_threshold]
-        if not hotspots.empty:
+        # Celdas de 0.01°: lat y lon enteras empaquetadas en una sola clave int64
+        lat_i = np.rint(mdf['lat'].to_numpy() * 100).astype(np.int32)
+        lon_i = np.rint(mdf['lon'].to_numpy() * 100).astype(np.int32)
+        key = (lat_i.astype(np.int64) << 32) | lon_i.view(np.uint32).astype(np.int64)
+        keys, counts = np.unique(key, return_counts=True)
+        mask = counts > heat_threshold
+        if mask.any():
+            hot = keys[mask]
+            hotspots = pd.DataFrame({
+                'lat_bin': (hot >> 32).astype(np.int32) / 100.0,
+                'lon_bin': (hot & 0xFFFFFFFF).astype(np.uint32).view(np.int32) / 100.0,
+                'count': counts[mask],
+            })
             st.warning(f'Se detectaron {len(hotspots)} zonas con más de {heat_threshold} delitos (coarse bins).')
             st.dataframe(hotspots)
     except Exception as e:
@@ -77,13 +113,14 @@ def show_map_points_and_heat(df: pd.DataFrame, heat_threshold: int = 50) -> None
 """"Muestra un gráfico de barras con las 10 ubicaciones más frecuentes donde ocurrieron delitos.
 
 @param df DataFrame que contiene la columna 'location_description' con las ubicaciones de los crímenes.
+@param df_fp Huella del contenido de `df` ya calculada por el llamador; si falta, se hashea la columna.
 
 @returns None. Muestra el gráfico directamente en Streamlit.
 """
-def show_additional_charts(df: pd.DataFrame) -> None:
+def show_additional_charts(df: pd.DataFrame, df_fp: Optional[int] = None) -> None:
     st.subheader('Top 10 ubicaciones')
     try:
-        top = df['location_description'].fillna('UNKNOWN').value_counts().head(10)
+        top = _column_counts(df, 'location_description', df_fp).head(10)
         st.bar_chart(top)
     except Exception:
         st.write('No se pudo generar top ubicaciones')